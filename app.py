@@ -1,36 +1,56 @@
+import collections
 import streamlit as st
 from engine import IntegrationEngine, ComputationResult
 
+_HISTORY_LIMIT = 50
+
+_KEYBOARD_LAYOUT = (
+    (("x²", "**2"), ("x³", "**3"), ("xⁿ", "**"), ("√", "sqrt(")),
+    (("sin", "sin("), ("cos", "cos("), ("tan", "tan("), ("eˣ", "exp(")),
+    (("π", "pi"), ("+", " + "), ("-", " - "), ("*", " * ")),
+    (("/", " / "), ("(", "("), (")", ")"), ("Clear", "CLEAR")),
+)
+
+@st.cache_resource
+def get_engine() -> IntegrationEngine:
+    return IntegrationEngine()
+
 class ApplicationUI:
     def __init__(self):
-        self.engine = IntegrationEngine()
+        self.engine = get_engine()
         self._initialize_state()
         
     def _initialize_state(self):
-        if "history" not in st.session_state:
-            st.session_state.history = []
-        if "expr_input" not in st.session_state:
-            st.session_state.expr_input = ""
+        state = st.session_state
+        if "history" not in state:
+            state.history = collections.deque(maxlen=_HISTORY_LIMIT)
+        if "history_keys" not in state:
+            state.history_keys = set()
+        if "expr_input" not in state:
+            state.expr_input = ""
 
     def _append_to_input(self, val: str):
         st.session_state.expr_input += val
 
+    def _clear_input(self):
+        st.session_state.expr_input = ""
+
+    @st.fragment
+    def render_input_panel(self):
+        """Renders the integrand box and keyboard as a fragment, so typing and keypresses rerun only this panel."""
+        st.text_input("Integrand f(x)", key="expr_input", placeholder="e.g., 3*x**2 or sin(x)")
+        
+        with st.expander("⌨️ Virtual Math Keyboard"):
+            self.render_virtual_keyboard()
+
     def render_virtual_keyboard(self):
         """Renders a clean math keyboard."""
-        keys = [
-            [("x²", "**2"), ("x³", "**3"), ("xⁿ", "**"), ("√", "sqrt(")],
-            [("sin", "sin("), ("cos", "cos("), ("tan", "tan("), ("eˣ", "exp(")],
-            [("π", "pi"), ("+", " + "), ("-", " - "), ("*", " * ")],
-            [("/", " / "), ("(", "("), (")", ")"), ("Clear", "CLEAR")]
-        ]
-        
-        for row in keys:
+        for row in _KEYBOARD_LAYOUT:
             cols = st.columns(4)
-            for i, (label, val) in enumerate(row):
-                with cols[i]:
+            for col, (label, val) in zip(cols, row):
+                with col:
                     if label == "Clear":
-                        if st.button(label, use_container_width=True, key=f"btn_{label}"):
-                            st.session_state.expr_input = ""
+                        st.button(label, on_click=self._clear_input, use_container_width=True, key=f"btn_{label}")
                     else:
                         st.button(label, on_click=self._append_to_input, args=(val,), use_container_width=True, key=f"btn_{label}")
 
@@ -63,47 +83,52 @@ class ApplicationUI:
             else:
                 st.warning(res.verification)
                 
-        # 5. Summary (Using native metrics)
+        # 5. Summary (Single table instead of three metric messages)
         st.markdown("<br>", unsafe_allow_html=True)
-        col1, col2, col3 = st.columns(3)
-        col1.metric("Runtime", res.summary.get("Runtime", "N/A"))
-        col2.metric("Iterations", res.summary.get("Iterations", "N/A"))
-        col3.metric("Computed At", res.summary.get("Timestamp", "N/A").split(" ")[1])
+        computed_at = res.summary.get("Timestamp", "N/A").split(" ")[-1]
+        st.markdown(
+            "| Runtime | Iterations | Computed At |\n|---|---|---|\n"
+            f"| {res.summary.get('Runtime', 'N/A')} | {res.summary.get('Iterations', 'N/A')} | {computed_at} |"
+        )
 
     def run(self):
+        state = st.session_state
         st.set_page_config(page_title="Symbolic Integrator", layout="centered", page_icon="∫")
         
         # Header
         st.title("∫ Indefinite Integration")
         st.markdown("Enter a mathematical expression to compute its indefinite integral.")
         
-        # Input Section
-        st.text_input("Integrand f(x)", key="expr_input", placeholder="e.g., 3*x**2 or sin(x)")
-        
-        # Keyboard Expander
-        with st.expander("⌨️ Virtual Math Keyboard"):
-            self.render_virtual_keyboard()
+        # Input Section & Keyboard Expander
+        self.render_input_panel()
             
+        paranoid = st.sidebar.toggle(
+            "Paranoid verification",
+            help="Also back-check answers from SymPy's integrator by differentiating them."
+        )
         submit_button = st.button("Compute Integral", type="primary", use_container_width=True)
 
         # Computation Logic
         if submit_button:
-            if not st.session_state.expr_input.strip():
+            current_input = state.expr_input.strip()
+            if not current_input:
                 st.error("Please enter an integrand.")
                 return
                 
             with st.spinner("Integrating..."):
-                current_input = st.session_state.expr_input.strip()
-                result = self.engine.compute(current_input)
+                result = self.engine.compute(current_input, paranoid)
                 
                 if result.is_success:
                     self.render_trail(result)
                     
-                    if not st.session_state.history or st.session_state.history[-1]["input"] != current_input:
-                        st.session_state.history.append({
+                    if current_input not in state.history_keys:
+                        if len(state.history) == state.history.maxlen:
+                            state.history_keys.discard(state.history[0]["input"])
+                        state.history.append({
                             "input": current_input,
-                            "result": result
+                            "final_answer": result.final_answer
                         })
+                        state.history_keys.add(current_input)
                 else:
                     st.error(f"Computation Failed: {result.error_message}")
 